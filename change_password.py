@@ -1,5 +1,5 @@
 
-from app import app, db, User
+from app import create_app, db, User
 from getpass import getpass
 
 def change_password():
@@ -8,7 +8,7 @@ def change_password():
     """
     username = input("Enter username: ")
     
-    with app.app_context():
+    with create_app().app_context():
         user = User.query.filter_by(username=username).first()
         
         if user is None:
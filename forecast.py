@@ -0,0 +1,96 @@
+"""
+Sales velocity and reorder forecasting.
+
+Daily sold and damaged quantities per product come from one grouped query and are
+laid out as a days x products matrix; every statistic is then computed on whole
+columns with pandas/NumPy, so years of history take about as long as a few weeks.
+
+The caller passes its session and models (Product, Sale, SaleItem, DamagedProduct):
+importing them from app here would load a second copy of app.py under the dev server
+(`python app.py` runs it as __main__), with a `db` the running app doesn't know.
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, literal, select, union_all
+
+# pandas dayofweek order (Monday = 0)
+WEEKDAY_NAMES = ['الإثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت', 'الأحد']
+
+def daily_quantities(session, models, start):
+    """Sold and damaged quantity per product and day since `start`, as a long DataFrame."""
+    Sale, SaleItem, DamagedProduct = models.Sale, models.SaleItem, models.DamagedProduct
+    sale_day = func.date(Sale.date)
+    damage_day = func.date(DamagedProduct.date)
+    sold = select(
+        SaleItem.product_id.label('product_id'), sale_day.label('day'),
+        func.sum(SaleItem.qty).label('sold'), literal(0).label('damaged')
+    ).join(Sale, SaleItem.sale_id == Sale.id).where(Sale.date >= start).group_by(SaleItem.product_id, sale_day)
+    damaged = select(
+        DamagedProduct.product_id, damage_day, literal(0), func.sum(DamagedProduct.quantity)
+    ).where(DamagedProduct.date >= start).group_by(DamagedProduct.product_id, damage_day)
+
+    rows = session.execute(union_all(sold, damaged)).all()
+    frame = pd.DataFrame(rows, columns=['product_id', 'day', 'sold', 'damaged'])
+    frame['day'] = pd.to_datetime(frame['day'])
+    return frame
+
+def day_matrix(frame, column, days, product_ids):
+    """Pivot one quantity into a days x products matrix, with zeros for days without movement."""
+    matrix = frame.pivot_table(index='day', columns='product_id', values=column, aggfunc='sum')
+    return matrix.reindex(index=days, columns=product_ids).fillna(0)
+
+def reorder_suggestions(session, models, lead_days=7, velocity_days=28, history_days=3 * 365, today=None):
+    """
+    One row per product with its recent velocity (units/day), damage rate, days of
+    stock left and the quantity to order so that stock is still at the reorder level
+    after `lead_days` of weekday-adjusted demand.
+    """
+    today = today or date.today()
+    start = today - timedelta(days=history_days - 1)
+    Product = models.Product
+    products = session.query(Product.id, Product.name, Product.stock, Product.reorder_level).order_by(Product.name).all()
+    columns = ['product_id', 'name', 'stock', 'reorder_level', 'velocity', 'peak_weekday', 'damage_rate',
+               'days_left', 'forecast', 'suggested_order']
+    if not products:
+        return pd.DataFrame(columns=columns)
+
+    info = pd.DataFrame(products, columns=['product_id', 'name', 'stock', 'reorder_level']).set_index('product_id')
+    info['stock'] = info['stock'].fillna(0)
+    frame = daily_quantities(session, models, datetime.combine(start, datetime.min.time()))
+    days = pd.date_range(start, today, freq='D')
+    sold = day_matrix(frame, 'sold', days, info.index)
+    damaged = day_matrix(frame, 'damaged', days, info.index)
+
+    # Rolling velocity over the most recent window
+    velocity = sold.rolling(velocity_days, min_periods=1).mean().iloc[-1]
+
+    # Weekday seasonality: each weekday's mean relative to the overall mean (1.0 without history)
+    overall = sold.mean()
+    weekday_factors = sold.groupby(sold.index.dayofweek).mean().reindex(range(7))
+    weekday_factors = weekday_factors.div(overall.replace(0, np.nan)).fillna(1.0)
+    upcoming = pd.date_range(today + timedelta(days=1), periods=lead_days, freq='D').dayofweek
+    forecast = velocity * weekday_factors.to_numpy()[upcoming].sum(axis=0)
+
+    # Part of the stock lost to breakage; demand on stock is sales / (1 - damage_rate)
+    total_sold = sold.sum()
+    total_damaged = damaged.sum()
+    damage_rate = (total_damaged / (total_sold + total_damaged).replace(0, np.nan)).fillna(0).clip(upper=0.95)
+    daily_need = velocity / (1 - damage_rate)
+    expected_need = forecast / (1 - damage_rate)
+
+    stock = info['stock'].astype(float)
+    days_left = np.where(daily_need > 0, stock / daily_need.where(daily_need > 0, 1), np.inf)
+    suggested = np.ceil((expected_need + info['reorder_level'] - stock).clip(lower=0))
+
+    result = info.assign(
+        velocity=velocity.round(2),
+        peak_weekday=weekday_factors.idxmax().where(total_sold > 0),
+        damage_rate=damage_rate.round(4),
+        days_left=np.round(days_left, 1),
+        forecast=forecast.round(1),
+        suggested_order=suggested.astype(int),
+    ).reset_index()[columns].sort_values(['days_left', 'name'])
+    # No sales history means no peak day and stock that never runs out; both become None
+    return result.astype(object).where(result.notna() & ~result.isin([np.inf]), None)
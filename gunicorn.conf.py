@@ -0,0 +1,24 @@
+# gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:app`.
+# Every value can be overridden through the environment.
+#
+# Graceful reload: `kill -HUP <master pid>` restarts the workers after their
+# current requests. Because the app is preloaded in the master, new code needs
+# `kill -USR2 <master pid>` (starts a new master) and then `kill -QUIT <old pid>`.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Threads let a worker keep serving while dashboards hold /events streams open
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Recycle workers now and then so a slow leak can't grow forever
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+preload_app = True
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+accesslog = '-'
+errorlog = '-'
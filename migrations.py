@@ -0,0 +1,302 @@
+"""
+Versioned schema migrations.
+
+Applied versions are recorded in the `schema_migration` table. Data backfills run
+in small id-ordered batches, each committed on its own with its position saved in
+`schema_migration_progress`, so an interrupted run resumes where it stopped. Every
+step takes the migration lock first (BEGIN IMMEDIATE on SQLite, an advisory lock on
+PostgreSQL) and re-reads that position under it, so two runners at once (this script
+and a starting server) take turns instead of applying a batch twice.
+
+Most migrations are safe to run from the command line while the server is up, batches
+pause between each other so checkout writes get the lock. Migrations marked `offline`
+rewrite data the running code still reads and writes (money_minor_units turns every
+amount into centimes), so they only run with --offline, once the server is stopped.
+The server applies the other pending migrations when it starts (init_database), before
+any worker serves requests, and refuses to start while an offline migration is pending.
+
+    python migrations.py              apply pending migrations, up to the first offline one
+    python migrations.py --offline    stop the server first; also applies offline migrations
+    python migrations.py --status     list applied and pending migrations
+"""
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+BATCH_SIZE = 500
+BATCH_PAUSE = 0.05  # seconds between batches, lets checkout writes take the lock
+LOCK_KEY = 4_209_117  # PostgreSQL advisory lock held by whoever is applying a migration step
+LOCK_POLL = 0.5  # seconds between attempts to take the migration lock
+STEP_DONE = -1  # schema_migration_progress.last_id of a finished schema step
+
+class Backfill:
+    """An UPDATE applied to `table` in batches of `batch_size` rows ordered by id."""
+
+    def __init__(self, table, assignments, batch_size=BATCH_SIZE):
+        self.table = table
+        self.assignments = assignments
+        self.batch_size = batch_size
+
+class CreateTable:
+    """Creates a table as declared by the models, for tables added after the first release."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def apply(self, conn):
+        from app import db
+        db.metadata.tables[self.table].create(conn, checkfirst=True)
+
+class CreateIndex:
+    """
+    An index that does not block writes while it is built, on PostgreSQL: CREATE INDEX
+    CONCURRENTLY, which cannot run inside a transaction. SQLite has no such option;
+    there the build holds the database write lock, so checkout waits until it is done.
+    """
+
+    def __init__(self, name, table, columns, where=None):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.where = where
+
+    def sql(self, concurrently=False):
+        statement = (f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS "
+                     f"{self.name} ON {self.table} ({self.columns})")
+        return statement + (f" WHERE {self.where}" if self.where else '')
+
+    def apply(self, conn):
+        conn.execute(text(self.sql()))
+
+    def apply_concurrently(self, engine):
+        """PostgreSQL: build outside any transaction, holding the migration lock for the session."""
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            lock_migrations(conn, session=True)
+            try:
+                # An interrupted concurrent build leaves an invalid index that IF NOT EXISTS would keep
+                valid = conn.execute(text(
+                    "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+                ), {'name': self.name}).scalar()
+                if valid is False:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}"))
+                conn.execute(text(self.sql(concurrently=True)))
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': LOCK_KEY})
+
+class Migration:
+    def __init__(self, version, name, steps, needed=None, offline=False):
+        self.version = version
+        self.name = name
+        self.steps = steps
+        # Optional check on the connection; a migration that is not needed is recorded without running
+        self.needed = needed
+        # Rewrites data in a form the previous release can't read or write: the server must be stopped
+        self.offline = offline
+
+def money_stored_as_numeric(conn):
+    # The former migrate_money.py script converted in place and marked the database with user_version 1
+    if conn.dialect.name == 'sqlite' and conn.exec_driver_sql("PRAGMA user_version").scalar() >= 1:
+        return False
+    columns = {c['name']: c['type'] for c in inspect(conn).get_columns('product')}
+    return str(columns['price_retail']).upper().startswith('NUMERIC')
+
+MIGRATIONS = [
+    Migration(1, 'money_minor_units', [
+        Backfill('product', "price_wholesale = CAST(ROUND(price_wholesale * 100) AS INTEGER), "
+                            "price_retail = CAST(ROUND(price_retail * 100) AS INTEGER)"),
+        Backfill('sale', "total = CAST(ROUND(total * 100) AS INTEGER), "
+                         "paid_amount = CAST(ROUND(paid_amount * 100) AS INTEGER), "
+                         "due_amount = CAST(ROUND(due_amount * 100) AS INTEGER)"),
+        Backfill('sale_item', "unit_price = CAST(ROUND(unit_price * 100) AS INTEGER), "
+                              "cost_price = CAST(ROUND(cost_price * 100) AS INTEGER)"),
+        Backfill('debt_transaction', "amount = CAST(ROUND(amount * 100) AS INTEGER)"),
+    ], needed=money_stored_as_numeric, offline=True),
+    Migration(2, 'report_indexes', [
+        CreateIndex('ix_sale_date', 'sale', 'date'),
+        CreateIndex('ix_sale_item_sale_id', 'sale_item', 'sale_id'),
+        CreateIndex('ix_debt_transaction_customer_date', 'debt_transaction', 'customer_id, date'),
+    ]),
+    Migration(3, 'dashboard_event', [CreateTable('dashboard_event')]),
+    Migration(4, 'product_reorder_level', [
+        "ALTER TABLE product ADD COLUMN reorder_level INTEGER NOT NULL DEFAULT 30",
+        CreateIndex('ix_product_low_stock', 'product', 'stock', where='stock <= reorder_level'),
+    ]),
+    Migration(5, 'audit_log', [CreateTable('audit_log')]),
+]
+
+def ensure_migration_tables(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migration ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at VARCHAR(32) NOT NULL)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migration_progress ("
+            "version INTEGER NOT NULL, step INTEGER NOT NULL, last_id INTEGER NOT NULL, "
+            "PRIMARY KEY (version, step))"
+        ))
+
+def applied_versions(engine):
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migration"))}
+
+def lock_migrations(conn, session=False):
+    """
+    Take the migration lock: on SQLite the database write lock (BEGIN IMMEDIATE, which
+    must be the first statement of the transaction), on PostgreSQL an advisory lock
+    released with the transaction, or with `session` held until pg_advisory_unlock.
+    PostgreSQL is polled with the try_ functions: a runner blocked inside a statement
+    keeps a snapshot open, and CREATE INDEX CONCURRENTLY waits for every such snapshot.
+    """
+    if conn.dialect.name == 'sqlite':
+        while True:
+            try:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                return
+            except OperationalError as error:
+                # Still locked after the busy timeout, e.g. by an index being built
+                if 'locked' not in str(error):
+                    raise
+            time.sleep(LOCK_POLL)
+    elif conn.dialect.name == 'postgresql':
+        function = 'pg_try_advisory_lock' if session else 'pg_try_advisory_xact_lock'
+        while not conn.execute(text(f"SELECT {function}(:key)"), {'key': LOCK_KEY}).scalar():
+            time.sleep(LOCK_POLL)
+
+def is_applied(conn, migration):
+    return conn.execute(text("SELECT 1 FROM schema_migration WHERE version = :v"),
+                        {'v': migration.version}).scalar() is not None
+
+def step_progress(conn, migration, step_index):
+    """Saved last_id of a step: 0 when it has not started, STEP_DONE for a finished schema step."""
+    last_id = conn.execute(text(
+        "SELECT last_id FROM schema_migration_progress WHERE version = :v AND step = :s"
+    ), {'v': migration.version, 's': step_index}).scalar()
+    return last_id if last_id is not None else 0
+
+def save_progress(conn, migration, step_index, last_id):
+    updated = conn.execute(text(
+        "UPDATE schema_migration_progress SET last_id = :last WHERE version = :v AND step = :s"
+    ), {'last': last_id, 'v': migration.version, 's': step_index}).rowcount
+    if not updated:
+        conn.execute(text(
+            "INSERT INTO schema_migration_progress (version, step, last_id) VALUES (:v, :s, :last)"
+        ), {'last': last_id, 'v': migration.version, 's': step_index})
+
+def record_applied(engine, migration):
+    """Record the migration as applied, unless another runner already did."""
+    with engine.begin() as conn:
+        lock_migrations(conn)
+        if is_applied(conn, migration):
+            return
+        conn.execute(text("INSERT INTO schema_migration (version, name, applied_at) VALUES (:v, :n, :t)"),
+                     {'v': migration.version, 'n': migration.name, 't': datetime.utcnow().isoformat(sep=' ')})
+        conn.execute(text("DELETE FROM schema_migration_progress WHERE version = :v"), {'v': migration.version})
+
+def run_backfill(engine, migration, step_index, backfill, pause=BATCH_PAUSE):
+    """Returns False when another runner has finished the migration meanwhile."""
+    with engine.connect() as conn:
+        total = conn.execute(text(f"SELECT COUNT(*) FROM {backfill.table}")).scalar()
+
+    done = 0
+    while True:
+        with engine.begin() as conn:
+            lock_migrations(conn)
+            # Read under the lock: another runner may have moved it since the last batch
+            if is_applied(conn, migration):
+                return False
+            last_id = step_progress(conn, migration, step_index)
+            upper = conn.execute(text(
+                f"SELECT MAX(id) FROM (SELECT id FROM {backfill.table} WHERE id > :last ORDER BY id LIMIT :n) AS batch"
+            ), {'last': last_id, 'n': backfill.batch_size}).scalar()
+            if upper is None:
+                return True
+            rows = conn.execute(text(
+                f"UPDATE {backfill.table} SET {backfill.assignments} WHERE id > :last AND id <= :upper"
+            ), {'last': last_id, 'upper': upper}).rowcount
+            save_progress(conn, migration, step_index, upper)
+        done += rows
+        print(f"  {backfill.table}: {done} rows updated (up to id {upper} of {total} rows)")
+        time.sleep(pause)
+
+def run_step(engine, migration, step_index, step):
+    """A schema step, applied once under the lock. Returns False when the migration is already recorded."""
+    with engine.begin() as conn:
+        lock_migrations(conn)
+        if is_applied(conn, migration):
+            return False
+        if step_progress(conn, migration, step_index) == STEP_DONE:
+            return True
+        if isinstance(step, str):
+            conn.execute(text(step))
+        else:
+            step.apply(conn)
+        save_progress(conn, migration, step_index, STEP_DONE)
+    return True
+
+def run_migration(engine, migration, pause=BATCH_PAUSE):
+    for step_index, step in enumerate(migration.steps):
+        if isinstance(step, Backfill):
+            applying = run_backfill(engine, migration, step_index, step, pause)
+        elif isinstance(step, CreateIndex) and engine.dialect.name == 'postgresql':
+            # Idempotent (IF NOT EXISTS), so it needs no progress row
+            step.apply_concurrently(engine)
+            applying = True
+        else:
+            # Schema statements are short; each gets its own transaction
+            applying = run_step(engine, migration, step_index, step)
+        if not applying:
+            print("  already applied by another process")
+            return
+    record_applied(engine, migration)
+
+def run_migrations(engine, pause=BATCH_PAUSE, offline=False):
+    """
+    Apply pending migrations in version order. A database without tables is new:
+    create_all builds it with the current schema, so every migration is only recorded.
+    `pause` is the sleep between backfill batches; 0 when nothing else is writing.
+    Without `offline` it stops before the first offline migration and returns it
+    (None when everything is applied).
+    """
+    new_database = not inspect(engine).has_table('product')
+    ensure_migration_tables(engine)
+    applied = applied_versions(engine)
+
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        needed = not new_database
+        if needed and migration.needed is not None:
+            with engine.connect() as conn:
+                needed = migration.needed(conn)
+        if needed and migration.offline and not offline:
+            return migration
+        if needed:
+            print(f"Applying migration {migration.version}: {migration.name}")
+            run_migration(engine, migration, pause)
+        else:
+            record_applied(engine, migration)
+    return None
+
+def print_status(engine):
+    ensure_migration_tables(engine)
+    applied = applied_versions(engine)
+    for migration in MIGRATIONS:
+        state = 'applied' if migration.version in applied else 'pending'
+        print(f"{migration.version:>4}  {migration.name:<30} {state}")
+
+if __name__ == '__main__':
+    from app import create_app, db
+
+    with create_app().app_context():
+        if '--status' in sys.argv[1:]:
+            print_status(db.engine)
+        else:
+            offline = '--offline' in sys.argv[1:]
+            # With the server stopped nothing else writes, so batches don't need to pause
+            blocked = run_migrations(db.engine, pause=0 if offline else BATCH_PAUSE, offline=offline)
+            if blocked:
+                sys.exit(f"Migration {blocked.version} ({blocked.name}) rewrites data the running server uses: "
+                         f"stop the server, then run `python migrations.py --offline`.")
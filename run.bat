@@ -1,4 +1,4 @@
 @echo off
-py app.py
+py run.py
 pause
 
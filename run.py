@@ -1,7 +1,18 @@
-from app import app, db, create_default_users
+import os
+import sys
 
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
-        create_default_users()
-    app.run(host="0.0.0.0", port=5000)
+    if os.name == 'nt':
+        # gunicorn does not run on Windows; waitress serves from a pool of threads in one process
+        from waitress import serve
+        from wsgi import app
+
+        serve(app,
+              listen=os.environ.get('BIND', '0.0.0.0:5000'),
+              threads=int(os.environ.get('WEB_THREADS', 16)),
+              channel_timeout=int(os.environ.get('WEB_TIMEOUT', 60)))
+    else:
+        from gunicorn.app.wsgiapp import run
+
+        sys.argv = ['gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+        run()
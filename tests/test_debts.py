@@ -0,0 +1,96 @@
+"""
+Debt aging, running balances and the Money column, on an in-memory SQLite database.
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, text
+
+from app import AGING_BUCKETS, Customer, DebtTransaction, Product, Sale, SaleItem, create_app, db, debt_aging, \
+    ledger_with_running_balance
+
+AS_OF = datetime(2025, 9, 30, 12, 0)
+
+@pytest.fixture
+def app():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+def add_customer(name, *transactions):
+    """transactions: (transaction_type, amount, days before AS_OF)"""
+    customer = Customer(name=name)
+    db.session.add(customer)
+    for transaction_type, amount, days_ago in transactions:
+        db.session.add(DebtTransaction(customer=customer, transaction_type=transaction_type, amount=Decimal(amount),
+                                       date=AS_OF - timedelta(days=days_ago)))
+    db.session.commit()
+    return customer
+
+def aging_by_name():
+    return {row.Customer.name: row for row in debt_aging(as_of=AS_OF)}
+
+def test_partial_payment_covers_oldest_debt_first(app):
+    add_customer('توفيق', ('debt', '100.00', 100), ('debt', '200.00', 45), ('payment', '150.00', 10),
+                 ('debt', '200.00', 5))
+    row = aging_by_name()['توفيق']
+    # The payment clears the 100 debt and 50 of the 200 one; the newest debt is still whole
+    assert (row.days_0_30, row.days_31_60, row.days_61_90, row.days_90_plus) == (
+        Decimal('200.00'), Decimal('150.00'), 0, 0)
+    assert row.total_debt == Decimal('350.00')
+
+def test_payments_beyond_debts_leave_nothing_to_age(app):
+    add_customer('حمزة', ('debt', '100.00', 40), ('payment', '150.00', 5))
+    add_customer('سليم', ('debt', '80.00', 20), ('debt', '20.00', 10), ('payment', '100.00', 1))
+    assert aging_by_name() == {}
+
+@pytest.mark.parametrize('days_ago, bucket', [
+    (30, 'days_0_30'),
+    (60, 'days_31_60'),
+    (90, 'days_61_90'),
+    (90.001, 'days_90_plus'),
+])
+def test_bucket_edges(app, days_ago, bucket):
+    add_customer('زبون', ('debt', '10.00', days_ago))
+    row = aging_by_name()['زبون']
+    assert {key: getattr(row, key) for key, _, _ in AGING_BUCKETS} == {
+        key: Decimal('10.00') if key == bucket else 0 for key, _, _ in AGING_BUCKETS
+    }
+
+def test_running_balance_counts_rows_before_since(app):
+    first = add_customer('توفيق', ('debt', '100.00', 100), ('debt', '200.00', 45), ('payment', '150.00', 10))
+    second = add_customer('حمزة', ('debt', '100.00', 40), ('payment', '150.00', 5))
+    rows = ledger_with_running_balance([first.id, second.id])
+    # Grouped by customer, newest first, each with the balance after it
+    assert [(row.DebtTransaction.customer_id, row.running_balance) for row in rows] == [
+        (first.id, Decimal('150.00')), (first.id, Decimal('300.00')), (first.id, Decimal('100.00')),
+        (second.id, Decimal('-50.00')), (second.id, Decimal('100.00')),
+    ]
+    since = ledger_with_running_balance([first.id], since=AS_OF - timedelta(days=50))
+    assert [row.running_balance for row in since] == [Decimal('150.00'), Decimal('300.00')]
+    assert first.balance == Decimal('150.00') and second.balance == Decimal('-50.00')
+
+def test_money_is_stored_in_centimes(app):
+    db.session.add(Product(name='بيض', price_wholesale=Decimal('12.345'), price_retail=Decimal('0.005')))
+    db.session.commit()
+    assert db.session.execute(text("SELECT price_wholesale, price_retail FROM product")).one() == (1235, 1)
+    product = db.session.query(Product).one()
+    assert (product.price_wholesale, product.price_retail) == (Decimal('12.35'), Decimal('0.01'))
+
+def test_money_expressions_read_back_as_decimal(app):
+    product = Product(name='بيض', price_wholesale=Decimal('400'), price_retail=Decimal('450'))
+    sale = Sale(total=Decimal('1350.50'), paid_amount=Decimal('1000'), due_amount=Decimal('350.50'))
+    sale.items = [SaleItem(product=product, qty=3, unit_price=Decimal('450.17'), cost_price=Decimal('400'))]
+    db.session.add(sale)
+    db.session.commit()
+
+    values = db.session.query(
+        func.sum(Sale.total), -Sale.due_amount, Sale.paid_amount - Sale.due_amount,
+        func.sum(SaleItem.unit_price * SaleItem.qty), func.sum((SaleItem.unit_price - SaleItem.cost_price) * SaleItem.qty),
+    ).join(SaleItem, SaleItem.sale_id == Sale.id).group_by(Sale.id).one()
+    assert tuple(values) == (
+        Decimal('1350.50'), Decimal('-350.50'), Decimal('649.50'), Decimal('1350.51'), Decimal('150.51'))
+    assert all(isinstance(value, Decimal) for value in values)
@@ -0,0 +1,80 @@
+"""
+Golden-file tests for the thermal receipts.
+
+The expected ESC/POS streams and text receipts live in tests/golden. After an
+intended change to the layout, regenerate them with
+
+    UPDATE_GOLDEN=1 pytest tests/test_thermal.py
+
+and check the new files (e.g. decode the .bin with cp864) before committing.
+"""
+import os
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from thermal import receipt_lines, render_escpos, render_text, reorder, shape
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden')
+
+def make_sale(id, items, paid, customer=None):
+    items = [SimpleNamespace(product=SimpleNamespace(name=name), qty=qty, unit_price=Decimal(price))
+             for name, qty, price in items]
+    total = sum(item.qty * item.unit_price for item in items)
+    paid = Decimal(paid) if paid is not None else total
+    return SimpleNamespace(
+        id=id, date=datetime(2025, 9, 7, 14, 53), items=items, total=total, paid_amount=paid,
+        due_amount=total - paid, customer=SimpleNamespace(name=customer) if customer else None,
+    )
+
+CASES = {
+    'fast_cash_sale': (make_sale(12, [('طبق بيض متوسط', 1, '500.00')], None), Decimal('0'), 48),
+    'credit_sale': (make_sale(31, [('طبق بيض ابيض', 50, '580.00'), ('بيض بلدي', 12, '25.50')], '10000',
+                              customer='توفيق'), Decimal('1250.75'), 48),
+    'long_product_name': (make_sale(40, [('طبق بيض كبير من مزرعة الهضاب العليا بسطيف', 3, '620.00')], None),
+                          Decimal('0'), 48),
+    'width_32': (make_sale(41, [('طبق بيض صغير', 2, '450.00'), ('بيض ابيض', 30, '16.00')], '500',
+                           customer='حمزة'), Decimal('300'), 32),
+}
+
+def check_golden(name, data):
+    path = os.path.join(GOLDEN_DIR, name)
+    if os.environ.get('UPDATE_GOLDEN'):
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    with open(path, 'rb') as f:
+        assert data == f.read()
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_escpos_matches_golden(case):
+    sale, previous_debt, width = CASES[case]
+    check_golden(f'{case}.bin', render_escpos(receipt_lines(sale, previous_debt, width)))
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_text_matches_golden(case):
+    sale, previous_debt, width = CASES[case]
+    check_golden(f'{case}.txt', render_text(receipt_lines(sale, previous_debt, width)).encode('utf-8'))
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_lines_fit_paper_width(case):
+    sale, previous_debt, width = CASES[case]
+    rows = render_escpos(receipt_lines(sale, previous_debt, width)).split(b'\n')
+    for row in rows:
+        # Drop the style commands around the text before measuring
+        for command in (b'\x1b@', b'\x1bt%', b'\x1bE\x00', b'\x1bE\x01', b'\x1d!\x00', b'\x1d!\x01'):
+            row = row.replace(command, b'')
+        assert len(row) <= width
+
+def test_shape_contextual_forms_and_lam_alef():
+    # بيض: initial beh, medial yeh, final dad
+    assert shape('بيض') == 'ﺑﻴﺾ'
+    # لا alone is the isolated ligature; after a joining letter it takes the final form
+    assert shape('لا') == 'ﻻ'
+    assert shape('ملا') == 'ﻣﻼ'
+
+def test_reorder_keeps_numbers_left_to_right():
+    assert reorder('رقم 12') == '12 ' + 'رقم'[::-1]
+    assert reorder('2025-09-07 14:53') == '2025-09-07 14:53'
@@ -0,0 +1,244 @@
+"""
+Thermal receipts: fixed-width text and ESC/POS byte streams built from a sale.
+
+Receipt printers print bytes left to right in a single-byte code page and know
+nothing about Arabic, so for ESC/POS the text is shaped here (each letter replaced
+by its isolated/initial/medial/final presentation form, lam-alef ligatures), put
+in visual order and encoded to PC864. The plain text output keeps logical order and
+leaves shaping to whatever displays it.
+"""
+import os
+import re
+import socket
+import time
+from urllib.parse import urlsplit
+
+# Letter -> first presentation form and number of forms, in Unicode order:
+# isolated, final (2 forms: joins only to the previous letter), initial, medial (4 forms)
+ARABIC_FORMS = {
+    'ء': (0xFE80, 1), 'آ': (0xFE81, 2), 'أ': (0xFE83, 2), 'ؤ': (0xFE85, 2),
+    'إ': (0xFE87, 2), 'ئ': (0xFE89, 4), 'ا': (0xFE8D, 2), 'ب': (0xFE8F, 4),
+    'ة': (0xFE93, 2), 'ت': (0xFE95, 4), 'ث': (0xFE99, 4), 'ج': (0xFE9D, 4),
+    'ح': (0xFEA1, 4), 'خ': (0xFEA5, 4), 'د': (0xFEA9, 2), 'ذ': (0xFEAB, 2),
+    'ر': (0xFEAD, 2), 'ز': (0xFEAF, 2), 'س': (0xFEB1, 4), 'ش': (0xFEB5, 4),
+    'ص': (0xFEB9, 4), 'ض': (0xFEBD, 4), 'ط': (0xFEC1, 4), 'ظ': (0xFEC5, 4),
+    'ع': (0xFEC9, 4), 'غ': (0xFECD, 4), 'ف': (0xFED1, 4), 'ق': (0xFED5, 4),
+    'ك': (0xFED9, 4), 'ل': (0xFEDD, 4), 'م': (0xFEE1, 4), 'ن': (0xFEE5, 4),
+    'ه': (0xFEE9, 4), 'و': (0xFEED, 2), 'ى': (0xFEEF, 2), 'ي': (0xFEF1, 4),
+}
+ISOLATED, FINAL, INITIAL, MEDIAL = range(4)
+TATWEEL = 'ـ'
+# Lam followed by one of these alefs is written as one ligature (isolated form; +1 for final)
+LAM_ALEF = {'آ': 0xFEF5, 'أ': 0xFEF7, 'إ': 0xFEF9, 'ا': 0xFEFB}
+HARAKAT = re.compile('[\u064B-\u065F\u0670]')
+
+LTR_RUN = re.compile(r'[0-9A-Za-z](?:[0-9A-Za-z .,:/%+\-]*[0-9A-Za-z])?')
+MIRRORED = str.maketrans('()[]<>', ')(][><')
+
+def joins_forward(char):
+    return char == TATWEEL or ARABIC_FORMS.get(char, (0, 0))[1] == 4
+
+def joins_back(char):
+    return char == TATWEEL or char in ARABIC_FORMS
+
+def shape(text):
+    """Replace Arabic letters with their contextual presentation forms (logical order is kept)."""
+    text = HARAKAT.sub('', text)
+    shaped = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char not in ARABIC_FORMS:
+            shaped.append(char)
+            i += 1
+            continue
+        after_joining = i > 0 and joins_forward(text[i - 1])
+        nxt = text[i + 1] if i + 1 < len(text) else ''
+        if char == 'ل' and nxt in LAM_ALEF:
+            shaped.append(chr(LAM_ALEF[nxt] + after_joining))
+            i += 2
+            continue
+        first, forms = ARABIC_FORMS[char]
+        before_joining = forms == 4 and joins_back(nxt)
+        if after_joining and before_joining:
+            form = MEDIAL
+        elif after_joining:
+            form = FINAL if forms > 1 else ISOLATED
+        elif before_joining:
+            form = INITIAL
+        else:
+            form = ISOLATED
+        shaped.append(chr(first + form))
+        i += 1
+    return ''.join(shaped)
+
+def is_rtl(text):
+    return any('\u0600' <= char <= '\u06FF' or '\uFE70' <= char <= '\uFEFF' for char in text)
+
+def reorder(text):
+    """
+    Logical -> visual (left to right) order. A simplified bidi: Arabic runs are
+    reversed while numbers and Latin words keep their direction, which is all a
+    receipt mixes.
+    """
+    if not is_rtl(text):
+        return text
+    parts = []
+    position = 0
+    for match in LTR_RUN.finditer(text):
+        parts.append(text[position:match.start()][::-1].translate(MIRRORED))
+        parts.append(match.group())
+        position = match.end()
+    parts.append(text[position:][::-1].translate(MIRRORED))
+    return ''.join(reversed(parts))
+
+def fallback_forms(encoding):
+    """
+    Code pages like PC864 lack some presentation forms; map each missing form to the
+    closest one the code page has (medial -> initial, final -> isolated, ...).
+    """
+    def encodable(code):
+        try:
+            chr(code).encode(encoding)
+            return True
+        except UnicodeEncodeError:
+            return False
+
+    preferences = {ISOLATED: (ISOLATED, FINAL, INITIAL, MEDIAL), FINAL: (FINAL, ISOLATED, MEDIAL, INITIAL),
+                   INITIAL: (INITIAL, MEDIAL, ISOLATED, FINAL), MEDIAL: (MEDIAL, INITIAL, FINAL, ISOLATED)}
+    table = {}
+    for first, forms in ARABIC_FORMS.values():
+        for form in range(forms):
+            candidates = [first + f for f in preferences[form] if f < forms]
+            table[first + form] = next((chr(c) for c in candidates if encodable(c)), None)
+    for ligature in LAM_ALEF.values():
+        for form in (0, 1):
+            candidates = [ligature + form, ligature + 1 - form, LAM_ALEF['ا'] + form]
+            table[ligature + form] = next((chr(c) for c in candidates if encodable(c)), None)
+    # Alef with hamza below has no form in PC864; plain alef is the readable substitute
+    for form in (ISOLATED, FINAL):
+        if table[0xFE87 + form] is None:
+            table[0xFE87 + form] = chr(0xFE8D + form)
+    # PC864 has the Arabic percent sign where ASCII has '%'
+    if not encodable(ord('%')) and encodable(0x066A):
+        table[ord('%')] = '٪'
+    return {code: sub for code, sub in table.items() if sub is not None and sub != chr(code)}
+
+PC864_FALLBACK = fallback_forms('cp864')
+
+def money(amount):
+    return f'{amount:.2f}'
+
+def receipt_lines(sale, previous_debt, width):
+    """
+    The receipt as lines of cells, in logical (right to left) order. A cell is
+    (text, width, align) with align 'start', 'end' or 'center'; the line style is
+    '' , 'bold' or 'title'.
+    """
+    qty_width, price_width, total_width = 5, 9, 10
+    name_width = width - qty_width - price_width - total_width
+    rule = ([('-' * width, width, 'start')], '')
+    lines = [
+        ([('سند بيع', width, 'center')], 'title'),
+        ([(f'رقم {sale.id}', width, 'center')], ''),
+        ([(sale.date.strftime('%Y-%m-%d %H:%M'), width, 'center')], ''),
+        rule,
+        ([('المنتج', name_width, 'start'), ('كمية', qty_width, 'end'),
+          ('السعر', price_width, 'end'), ('الإجمالي', total_width, 'end')], 'bold'),
+        rule,
+    ]
+    narrow = name_width < 12
+    for item in sale.items:
+        name = item.product.name if item.product else ''
+        if narrow:
+            # 58 mm paper: the product name gets its own line
+            lines.append(([(name, width, 'start')], ''))
+            name = ''
+        lines.append(([(name, name_width, 'start'), (str(item.qty), qty_width, 'end'),
+                       (money(item.unit_price), price_width, 'end'),
+                       (money(item.qty * item.unit_price), total_width, 'end')], ''))
+    lines.append(rule)
+
+    totals = [('مجموع الفاتورة:', sale.total, 'bold'), ('المبلغ المدفوع:', sale.paid_amount, ''),
+              ('المبلغ المتبقي:', sale.due_amount, '')]
+    if sale.customer:
+        totals += [('الديون السابقة:', previous_debt, ''), ('إجمالي الديون:', sale.due_amount + previous_debt, 'bold')]
+    for label, amount, style in totals:
+        lines.append(([(label, width - total_width, 'start'), (money(amount), total_width, 'end')], style))
+    lines.append(rule)
+    customer = sale.customer.name if sale.customer else 'زبون نقدي'
+    lines.append(([(f'الزبون: {customer}', width, 'start')], ''))
+    return lines
+
+def pad(text, width, align, visual):
+    space = width - len(text)
+    if align == 'center':
+        left = space // 2
+        return ' ' * left + text + ' ' * (space - left)
+    # In logical order the start of an RTL cell is its right edge; on paper that is padding on the left
+    if (align == 'start') == visual:
+        return ' ' * space + text
+    return text + ' ' * space
+
+def render_text(lines):
+    """Fixed-width UTF-8 text in logical order."""
+    rows = [''.join(pad(HARAKAT.sub('', text)[:width], width, align, visual=False) for text, width, align in cells)
+            for cells, style in lines]
+    return '\n'.join(row.rstrip() for row in rows) + '\n'
+
+ESC_INIT = b'\x1b@'
+ESC_BOLD = (b'\x1bE\x00', b'\x1bE\x01')
+GS_DOUBLE_HEIGHT = (b'\x1d!\x00', b'\x1d!\x01')
+FEED_AND_CUT = b'\x1bd\x04\x1dV\x01'
+
+def render_escpos(lines, codepage=37):
+    """
+    ESC/POS commands for the receipt; `codepage` is the printer's ESC t number for
+    PC864 (37 on Epson, other brands use other numbers).
+    """
+    out = bytearray(ESC_INIT + b'\x1bt' + bytes([codepage]))
+    for cells, style in lines:
+        # Cut in logical order, before reordering, so a long name loses its end and not its start
+        row = ''.join(pad(reorder(shape(text)[:width]), width, align, visual=True)
+                      for text, width, align in reversed(cells))
+        bold, title = style in ('bold', 'title'), style == 'title'
+        if bold:
+            out += ESC_BOLD[1]
+        if title:
+            out += GS_DOUBLE_HEIGHT[1]
+        out += row.rstrip().translate(PC864_FALLBACK).encode('cp864', errors='replace') + b'\n'
+        if title:
+            out += GS_DOUBLE_HEIGHT[0]
+        if bold:
+            out += ESC_BOLD[0]
+    out += FEED_AND_CUT
+    return bytes(out)
+
+def render_receipt(lines, kind, codepage=37):
+    """
+    The receipt as `kind` ('escpos' or 'txt'). Not cached: rendering takes well under
+    a millisecond, and the printed balance changes with every later sale or payment of
+    the customer, so a cached receipt would need invalidating in every worker process.
+    """
+    return render_escpos(lines, codepage) if kind == 'escpos' else render_text(lines)
+
+def send_to_printer(data, target, timeout=5):
+    """
+    Send raw bytes to the receipt printer. `target` is either tcp://host:port (network
+    printers, usually port 9100) or a path: a device such as /dev/usb/lp0, a shared
+    Windows printer (\\\\localhost\\POS80), or a spool directory a print agent watches.
+    """
+    if target.startswith('tcp://'):
+        address = urlsplit(target)
+        with socket.create_connection((address.hostname, address.port or 9100), timeout=timeout) as conn:
+            conn.sendall(data)
+        return
+    if os.path.isdir(target):
+        # Written under a temporary name first so the agent never picks up half a receipt
+        name = os.path.join(target, f'receipt_{time.time_ns()}')
+        with open(name + '.tmp', 'wb') as spooled:
+            spooled.write(data)
+        os.replace(name + '.tmp', name + '.bin')
+        return
+    with open(target, 'wb') as printer:
+        printer.write(data)
@@ -0,0 +1,12 @@
+"""
+WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app     (Linux, several worker processes)
+    python run.py                             (picks gunicorn, or waitress on Windows)
+
+The app is built in preload mode: with gunicorn's preload_app the database setup,
+templates and report libraries are loaded once in the master and shared by the workers.
+"""
+from app import create_app
+
+app = create_app(preload=True)